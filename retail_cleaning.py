@@ -17,9 +17,26 @@
 
 import pandas as pd
 import numpy as np
-from fuzzywuzzy import process, fuzz
+from rapidfuzz import process, fuzz, utils
 import re
 
+def __map_categories(series, func):
+    """
+    pd.Series, function -> pd.Series
+    
+    Applies a string function to the unique values (categories) of a 
+    categorical series, rather than to every row, and re-encodes the result.
+    Categories that become equal (e.g. after stripping) are merged
+    
+    Examples:
+        __map_categories(series, lambda values: values.str.strip())
+    """
+    codes = series.cat.codes.to_numpy()
+    new_codes, new_categories = pd.factorize(func(series.cat.categories))
+    codes = np.where(codes == -1, -1, new_codes[codes])
+    
+    return pd.Series(pd.Categorical.from_codes(codes, new_categories), index = series.index, name = series.name)
+
 def __matching_descriptions_helper(nonupper):
     """
     pd.DataFrame -> pd.DataFrame
@@ -38,18 +55,19 @@ def __matching_descriptions_helper(nonupper):
     """
     df = nonupper.copy()
     
-    unique_descr = df['Description'].unique()
+    # Sorted so that i > j <=> description > potential_match (dedups symmetric pairs)
+    unique_descr = np.sort(df['Description'].dropna().astype(object).unique())
     
-    score_sort = [(x,) + i
-                  for x in unique_descr 
-                  for i in process.extract(x, unique_descr, scorer=fuzz.token_sort_ratio)]
-    similarity = pd.DataFrame(score_sort, columns=['description','potential_match','score_sort'])
-    similarity['sorted_description'] = np.minimum(similarity['description'], similarity['potential_match'])
+    # Full similarity matrix in one call (scores under the cutoff are set to 0)
+    scores = process.cdist(unique_descr, unique_descr, scorer=fuzz.token_sort_ratio,
+                           processor=utils.default_process, score_cutoff=70,
+                           dtype=np.uint8, workers=-1)
+    # Only the strict lower triangle: drops self matches and symmetric pairs
+    i_idx, j_idx = np.nonzero(np.tril(scores >= 70, k = -1))
     
-    suggestions = similarity.loc[(similarity['score_sort'] >= 70) &
-                                 ~(similarity['description'] == similarity['potential_match']) &
-                                 ~(similarity['description'] == similarity['sorted_description'])]
-    suggestions.drop(columns = {'sorted_description'}, inplace = True)
+    suggestions = pd.DataFrame.from_dict({'description': unique_descr[i_idx],
+                                          'potential_match': unique_descr[j_idx],
+                                          'score_sort': scores[i_idx, j_idx]})
     
     totals = suggestions.groupby(['description','score_sort']).agg(
                                 {'potential_match': ', '.join}).sort_values(
@@ -81,11 +99,17 @@ def __map_item_issues_to_groupings(df):
     # Final category will be 'Unclassified issue'. We could classify more, but
     # it would be too time intensive for this exercise
     
-    df['IssueCategory'] = 'Unclassified'
-    df['Description_Lower'] = df['Description'].str.lower()
-    for classification, term_list in issue_categories.items():
-        for term in term_list:
-            df.loc[df['Description_Lower'].str.contains(term), 'IssueCategory'] = classification
+    # One regex for all categories: an optional lookahead per category, each with
+    # a named group that captures if any of its (literal) terms is in the string.
+    # Case insensitive, so no lower case copy of the descriptions is needed
+    issues_pattern = re.compile('^' + ''.join(f'(?:(?=.*?(?P<category_{i}>' + '|'.join(re.escape(term) for term in term_list) + ')))?'
+                                              for i, term_list in enumerate(issue_categories.values())),
+                                re.IGNORECASE)
+    
+    hits = df['Description'].str.extract(issues_pattern).notna()
+    hits.columns = list(issue_categories)
+    # Later categories take precedence where a description matches several
+    df['IssueCategory'] = hits[hits.columns[::-1]].idxmax(axis = 1).where(hits.any(axis = 1), 'Unclassified')
     
     df['IssueWithItem'] = True
     
@@ -94,6 +118,44 @@ def __map_item_issues_to_groupings(df):
     
     return df[['Description','IssueWithItem','IssueCategory']]
 
+def __overwrite_descriptions(dataframe, lookup):
+    """
+    pd.DataFrame, pd.Series -> pd.DataFrame
+    
+    Overwrites Descriptions using lookup, a Series of new Descriptions indexed
+    by (StockCode, Description). Rows with no match in lookup are left as they 
+    are. Matched with get_indexer, so no per row tuples are built
+    """
+    keys = pd.MultiIndex.from_arrays([dataframe['StockCode'], dataframe['Description']])
+    idx = lookup.index.get_indexer(keys)
+    mask = idx != -1
+    dataframe.loc[mask, 'Description'] = lookup.to_numpy()[idx[mask]]
+    
+    return dataframe
+
+def __top_quantity_rows(duplicates):
+    """
+    pd.DataFrame -> np.ndarray
+    
+    Boolean mask of the rows in duplicates holding the max Quantity for their 
+    StockCode (ties are all kept). Works on the StockCode category codes with a
+    sort and np.maximum.reduceat, rather than a groupby max merged back on
+    """
+    codes = duplicates['StockCode'].cat.codes.to_numpy()
+    quantity = duplicates['Quantity'].to_numpy()
+    is_top = np.zeros(len(codes), dtype = bool)
+    if len(codes) == 0:
+        return is_top
+    
+    order = np.argsort(codes, kind = 'stable')
+    sorted_codes = codes[order]
+    sorted_quantity = quantity[order]
+    group_starts = np.concatenate(([True], sorted_codes[1:] != sorted_codes[:-1]))
+    group_max = np.maximum.reduceat(sorted_quantity, np.flatnonzero(group_starts))
+    is_top[order] = sorted_quantity == group_max[np.cumsum(group_starts) - 1]
+    
+    return is_top
+
 def __overwrite_check_records(dataframe, duplicates):
     """
     pd.DataFrame, pd.DataFrame -> pd.DataFrame, pd.DataFrame
@@ -101,9 +163,7 @@ def __overwrite_check_records(dataframe, duplicates):
     Records where the description is "check" get overwritten with the other 
     description matching that StockCode. duplicates is adjusted accoringly
     """
-    top_descriptions = duplicates.groupby('StockCode')['Quantity'].max().reset_index()
-    top_descriptions = top_descriptions.merge(duplicates, on = ['StockCode','Quantity'],
-                                              how = 'inner', validate = 'one_to_many')
+    top_descriptions = duplicates.loc[__top_quantity_rows(duplicates)]
     
     # Identify any duplicate StockCodes to deal with manually
     #dupes = top_descriptions.loc[top_descriptions.duplicated(subset = 'StockCode', keep = False)]
@@ -121,16 +181,11 @@ def __overwrite_check_records(dataframe, duplicates):
     checks = checks.merge(top_descriptions, on = 'StockCode', validate = 'one_to_one')
     checks.drop(columns = {'Quantity'}, inplace = True)
     
-    # Update dataframe
-    dataframe = dataframe.merge(checks, on = ['StockCode', 'Description'], how = 'left')
-    dataframe.loc[~(dataframe['Description_New'].isna()), 'Description'] = dataframe.loc[~(dataframe['Description_New'].isna()), 'Description_New']
-    dataframe.drop(columns = {'Description_New'}, inplace = True)
-    
-    # Update duplicates
-    duplicates = duplicates.merge(checks, on = ['StockCode', 'Description'], how = 'left')
-    duplicates.loc[~(duplicates['Description_New'].isna()), 'Description'] = duplicates.loc[~(duplicates['Description_New'].isna()), 'Description_New']
-    duplicates.drop(columns = {'Description_New'}, inplace = True)
-    duplicates = duplicates.groupby(['StockCode','Description'])['Quantity'].sum().reset_index()
+    # Update dataframe and duplicates with a (StockCode, Description) -> new Description lookup
+    checks_lookup = checks.set_index(['StockCode','Description'])['Description_New']
+    dataframe = __overwrite_descriptions(dataframe, checks_lookup)
+    duplicates = __overwrite_descriptions(duplicates, checks_lookup)
+    duplicates = duplicates.groupby(['StockCode','Description'], observed = True)['Quantity'].sum().reset_index()
     duplicates = duplicates.loc[duplicates.duplicated(subset = 'StockCode', keep = False)]
     
     return dataframe, duplicates
@@ -144,18 +199,16 @@ def __overwrite_duped_descriptions(dataframe, duplicates):
     already been added to record the "issues" found in the Description field
     """
     # Create a mapping of "issue" descriptions to new descriptions
-    new_descr = duplicates.groupby(['StockCode'])['Quantity'].max().reset_index()
-    new_descr = new_descr.merge(duplicates, on = ['StockCode','Quantity']).rename(columns = {'Description':'Description_New','Quantity':'QuantityMax'})
+    new_descr = duplicates.loc[__top_quantity_rows(duplicates), ['StockCode','Description']].rename(columns = {'Description':'Description_New'})
     new_descr = new_descr.loc[~(new_descr['Description_New'] == 'S/16 VINTAGE IVORY CUTLERY')] # Cases where a StockCode has two max Quantities
     new_descr = new_descr.loc[~((new_descr['Description_New'] == 'found') & (new_descr['StockCode'] == '35598C'))] 
     
-    descr_mapping = new_descr.merge(duplicates, on = ['StockCode'])
-    descr_mapping.drop(columns = {'Quantity','QuantityMax'}, inplace = True)
+    # Each StockCode must have one new description (any unhandled tie at the max Quantity fails here)
+    descr_mapping = new_descr.merge(duplicates[['StockCode','Description']], on = ['StockCode'], validate = 'one_to_many')
     
     # Use this to update Descriptions in the main dataframe
-    dataframe = dataframe.merge(descr_mapping, on = ['StockCode', 'Description'], how = 'left')
-    dataframe.loc[~(dataframe['Description_New'].isna()), 'Description'] = dataframe.loc[~(dataframe['Description_New'].isna()), 'Description_New']
-    dataframe.drop(columns = {'Description_New'}, inplace = True)
+    descr_mapping = descr_mapping.set_index(['StockCode','Description'])['Description_New']
+    dataframe = __overwrite_descriptions(dataframe, descr_mapping)
     
     return dataframe
     
@@ -178,32 +231,36 @@ def __address_duplicate_descriptions(dataframe):
     issues in their orders, and what type of issue it was.
     """
     # Some common cases where only a couple of letters are lower case
-    dataframe['Description'] = dataframe['Description'].str.replace('x40cm', 'X40CM')
-    dataframe['Description'] = dataframe['Description'].str.replace('x45cm', 'X45CM')
-    dataframe['Description'] = dataframe['Description'].str.replace('x30CM', 'X30CM')
-    dataframe['Description'] = dataframe['Description'].str.replace('x30cm', 'X30CM')
-    
-    dataframe['Description'] = dataframe['Description'].str.replace('TRADITIONAl', 'TRADITIONAL')
-    
-    dataframe['Description'] = dataframe['Description'].str.replace('No', 'NO')
+    corrections = {'x40cm':'X40CM', 'x45cm':'X45CM', 'x30CM':'X30CM', 'x30cm':'X30CM',
+                   'TRADITIONAl':'TRADITIONAL',
+                   'No':'NO'}
+    # All fixes in a single regex pass
+    corrections_pattern = re.compile('|'.join(re.escape(old) for old in corrections))
+    dataframe['Description'] = __map_categories(dataframe['Description'],
+                                                lambda values: values.str.replace(corrections_pattern,
+                                                                                  lambda match: corrections[match.group(0)],
+                                                                                  regex = True))
     
     # Get unique pairs (item, description), and find duplicates
-    items = dataframe.groupby(['StockCode','Description'])['Quantity'].sum().reset_index()
+    items = dataframe.groupby(['StockCode','Description'], observed = True)['Quantity'].sum().reset_index()
     duplicates = items.loc[items.duplicated(subset = ['StockCode'], keep = False)]
     
     # Overwrite "check" descriptions with the correct labels
     dataframe, duplicates = __overwrite_check_records(dataframe, duplicates)
     
     # Items with "issues" recorded instead of "Description" are non-upper case
-    issues = duplicates.loc[~(duplicates.Description.str.isupper())].groupby(['Description'])['Quantity'].sum().reset_index().drop(columns = {'Quantity'})
+    issues = duplicates.loc[~(duplicates.Description.str.isupper())].groupby(['Description'], observed = True)['Quantity'].sum().reset_index().drop(columns = {'Quantity'})
     # Group these "issue" items according to their issue
     issues = __map_item_issues_to_groupings(issues)
     
-    # Add issues & issue categories, overwrite extraneous descriptions
-    dataframe = dataframe.merge(issues, on = 'Description', how = 'left')
+    # Add issues & issue categories (looked up by Description), overwrite extraneous descriptions
+    dataframe['IssueWithItem'] = dataframe['Description'].isin(issues['Description'])
+    dataframe['IssueCategory'] = dataframe['Description'].map(dict(zip(issues['Description'], issues['IssueCategory'])))
     dataframe = __overwrite_duped_descriptions(dataframe, duplicates)
     
     # HACK - For StockCode '84968B' which we had to exclude earlier
+    if 'SET OF 16 VINTAGE IVORY CUTLERY' not in dataframe['Description'].cat.categories:
+        dataframe['Description'] = dataframe['Description'].cat.add_categories('SET OF 16 VINTAGE IVORY CUTLERY')
     dataframe.loc[dataframe['StockCode'] == '84968B', 'Description'] = 'SET OF 16 VINTAGE IVORY CUTLERY'
     
     return dataframe
@@ -234,35 +291,45 @@ def cleaning_main(dataframe):
             (so these can be filtered out of any modelling + reporting)
     
     """
-    # Make StockCode upper case
-    dataframe['StockCode'] = dataframe['StockCode'].str.upper()
+    # Low cardinality string columns as categories, so the string cleaning below
+    # runs on the unique values, and groupbys/merges work on the codes
+    for col in ['StockCode','Description','Country','Invoice']:
+        dataframe[col] = dataframe[col].astype('category')
     
-    # Drop duplicate entries
-    #dataframe = dataframe.loc[~(dataframe.duplicated(keep = 'last'))]
+    # Make StockCode upper case
+    dataframe['StockCode'] = __map_categories(dataframe['StockCode'], lambda values: values.str.upper())
     
-    dataframe['CancelledOrder'] = dataframe.Invoice.str.contains('C')
     # Create numeric stock codes
     #dataframe['StockCodeNumeric'] = dataframe['StockCode'].apply(lambda x: re.sub(r'[a-zA-z]','', x))
     
     # For string columns, remove trailing and leading spaces (if there)
-    for col in dataframe.columns:
-        if dataframe[col].dtype == object:
-            dataframe[col] = dataframe[col].str.strip()
+    for col in ['StockCode','Description','Country','Invoice']:
+        dataframe[col] = __map_categories(dataframe[col], lambda values: values.str.strip())
+    
+    # Narrower numeric types (Customer ID as a nullable integer), fewer bytes per row.
+    # Price stays float64, as float32 prices add noise to the spend totals reported on
+    dataframe['Quantity'] = dataframe['Quantity'].astype('int32')
+    dataframe['Customer ID'] = dataframe['Customer ID'].astype('Int32')
+    
+    # Drop duplicate entries (after the casts above, so the string columns hash as category codes)
+    #dataframe = dataframe.loc[~(dataframe.duplicated(keep = 'last'))]
     
     # Multi descriptions for one Stockcode, overwrite or re-classify as an issue
     dataframe['OrigDescription'] = dataframe['Description']
     dataframe = __address_duplicate_descriptions(dataframe)
-    dataframe['IssueWithItem'].fillna(False, inplace = True)
     
     
-    # Deal with other incomplete /negative data: price, description, quantity
-    dataframe['NoDescriptionOrPrice'] = dataframe['Description'].isna()
-    dataframe['PriceIsCredit'] = (dataframe['Price'] < 0)
-    dataframe['QuantityLeqZero'] = (dataframe['Quantity'] <= 0)
+    # Flag cancelled orders (Invoice starting with a 'C'), and other incomplete /negative data: price, description, quantity
+    # (computed on the underlying arrays, and added in a single assign)
+    dataframe = dataframe.assign(CancelledOrder = dataframe['Invoice'].str.startswith('C', na = False).to_numpy(dtype = bool),
+                                 NoDescriptionOrPrice = dataframe['Description'].isna().to_numpy(),
+                                 PriceIsCredit = dataframe['Price'].to_numpy() < 0,
+                                 QuantityLeqZero = dataframe['Quantity'].to_numpy() <= 0)
     
-    # Create Time, Date seperately
-    dataframe['Date'] = dataframe['InvoiceDate'].dt.date
-    dataframe['Time'] = dataframe['InvoiceDate'].dt.time
+    # Create Time, Date seperately (Date kept as datetime64, Time as seconds from midnight, <NA> if no InvoiceDate)
+    dataframe['Date'] = dataframe['InvoiceDate'].dt.normalize()
+    dataframe['Time'] = (dataframe['InvoiceDate'].dt.hour * 3600 + dataframe['InvoiceDate'].dt.minute * 60
+                         + dataframe['InvoiceDate'].dt.second).astype('Int32')
     
     # Reorder columns
     columns = ['Invoice','StockCode','Description','OrigDescription','Customer ID','Country',
@@ -37,17 +37,32 @@ def __minus_bad_chars(string):
     return good_string
 
 ### - Output helpers
-def dictionary_dump(frames, outputs, filename):
+def dictionary_dump(frames, outputs, filename, file_format = 'xlsx'):
     """
-    dict, str, str -> None
+    dict, str, str, str -> None
     
     Outputs a dictionary of pandas dataframes as an excel workbook in the 
     outputs location (with each sheet having a key name from the dict).
     
-    Will raise an error if one of the values in the dict isn't a dataframe
+    With file_format = 'parquet', each dataframe is instead written to its own
+    (zstd compressed) parquet file, named as filename_Key.parquet. Much faster
+    to write than excel, for consumers that can read parquet
+    
+    Will raise an error if one of the values in the dict isn't a dataframe, or
+    if file_format isn't one of 'xlsx' or 'parquet'
     """
+    if file_format not in {'xlsx', 'parquet'}:
+        raise ValueError(f"file_format must be 'xlsx' or 'parquet', not {file_format!r}")
+    
+    if file_format == 'parquet':
+        for key, frame in frames.items():
+            written_key = __title__(__minus_bad_chars(key))
+            frame.to_parquet(fr'{outputs}\{filename}_{written_key}.parquet',
+                             engine = 'pyarrow', compression = 'zstd')
+        return None
+    
     out_path = fr'{outputs}\{filename}.xlsx'
-    with ExcelWriter(out_path) as writer:
+    with ExcelWriter(out_path, engine = 'xlsxwriter') as writer:
         for key, frame in frames.items():
             written_key = __title__(__minus_bad_chars(key))
             frame.to_excel(writer, sheet_name = written_key)
@@ -50,8 +50,11 @@ def __load_data(source):
     Also performs some standard profiling of the given data 
     (distributional and point estimates).
     """
-    # Specify datatypes for InvoiceDate as it loads as generic object
-    dataframe = pd.read_csv(source, parse_dates = ['InvoiceDate'])
+    # Specify datatypes for InvoiceDate as it loads as generic object, and keep the
+    # string columns as strings (Country dictionary encoded) when read with pyarrow
+    dtypes = {'Invoice':'string[pyarrow]', 'StockCode':'string[pyarrow]',
+              'Description':'string[pyarrow]', 'Country':'category'}
+    dataframe = pd.read_csv(source, engine = 'pyarrow', dtype = dtypes, parse_dates = ['InvoiceDate'])
     
     return dataframe
 
@@ -13,6 +13,8 @@
 """
 
 import pandas as pd
+import numpy as np
+import polars as pl
 
 def __subset_useful_data(df_cleaned):
     """
@@ -48,28 +50,28 @@ def __RFM_identification(rfm_data):
     """
     max_date = rfm_data['Date'].max()
     
-    ### - Recency
-    recency = (max_date - rfm_data.groupby('Customer ID')['Date'].max()).dt.days
-    recency = recency.reset_index()
-    recency.rename(columns = {'Date':'DaysSinceLastPurchase(R)'},  inplace = True)
-    
-    ### - Frequency
-    frequency = rfm_data[['Customer ID', 'Date']].drop_duplicates().groupby('Customer ID')['Date'].count().reset_index()
-    frequency.rename(columns = {'Date':'NumberOfOrders(F)'},  inplace = True)
-    
-    ### - Monetary value (assuming Total price = Price * Quantity)
-    monetary = rfm_data[['Customer ID', 'Price', 'Quantity']]
-    monetary['TotalPrice'] = monetary['Price'] * monetary['Quantity']
-    monetary = monetary.groupby('Customer ID')['TotalPrice'].sum().reset_index()
-    monetary.rename(columns = {'TotalPrice':'TotalSpent(M)'}, inplace = True)
+    ### - Recency, Frequency & Monetary value (assuming Total price = Price * Quantity), as
+    ### one (multithreaded) polars aggregation
+    customer_rfm = (pl.from_pandas(rfm_data[['Customer ID', 'Date', 'Price', 'Quantity']])
+                    .lazy()
+                    .group_by('Customer ID')
+                    .agg(pl.col('Date').max().alias('LastPurchase'),
+                         pl.col('Date').n_unique().alias('NumberOfOrders(F)'),
+                         (pl.col('Price').cast(pl.Float64) * pl.col('Quantity')).sum().alias('TotalSpent(M)'))
+                    .sort('Customer ID')
+                    .collect()
+                    .to_pandas())
+    customer_rfm['DaysSinceLastPurchase(R)'] = (max_date - customer_rfm['LastPurchase']).dt.days
+    # Round spend to pence (the parallel sum can differ from a sequential one in the last bits)
+    customer_rfm['TotalSpent(M)'] = customer_rfm['TotalSpent(M)'].round(2)
     
     # - Simple plotting to understand distrns better
-    recency.hist(column = 'DaysSinceLastPurchase(R)')
-    frequency.hist(column = 'NumberOfOrders(F)')
-    monetary.hist(column = 'TotalSpent(M)')
+    customer_rfm.hist(column = 'DaysSinceLastPurchase(R)')
+    customer_rfm.hist(column = 'NumberOfOrders(F)')
+    customer_rfm.hist(column = 'TotalSpent(M)')
     # Freq & Monetary are power-law, recency exponential. Let's trim freq & mon
-    frequency.loc[frequency['NumberOfOrders(F)']<=50].hist(column = 'NumberOfOrders(F)')
-    monetary.loc[monetary['TotalSpent(M)']<=10000].hist(column = 'TotalSpent(M)')
+    customer_rfm.loc[customer_rfm['NumberOfOrders(F)']<=50].hist(column = 'NumberOfOrders(F)')
+    customer_rfm.loc[customer_rfm['TotalSpent(M)']<=10000].hist(column = 'TotalSpent(M)')
     
     
     # Given the power law distrns, we could really spend more time figuring out
@@ -79,42 +81,45 @@ def __RFM_identification(rfm_data):
     ## - Frequency: >50 orders = Big orderer, ..., 1 Order = One time customer
     ## - Monetary: >100,000 = Huge spender, 10,000-100,000 = Big spender, ..., 0-500 = Small time
     
-    # Map frequencies
-    recency['Recency'] = pd.cut(recency['DaysSinceLastPurchase(R)'],
-                                bins = [-1,30,90,360,800],
-                                labels = [4,3,2,1]).astype(int)
-    frequency['Frequency'] = pd.cut(frequency['NumberOfOrders(F)'],
-                                    bins = [-1,3,8,35,300],
-                                    labels = [1,2,3,4]).astype(int)
-    monetary['Monetary'] = pd.cut(monetary['TotalSpent(M)'],
-                                    bins = [-1,1000,10000,100000,1000000],
-                                    labels = [1,2,3,4]).astype(int)
+    # Map frequencies (searchsorted on the inner bin edges, right-inclusive as with pd.cut)
+    customer_rfm['Recency'] = (4 - np.searchsorted([30,90,360], customer_rfm['DaysSinceLastPurchase(R)'])).astype('int8')
+    customer_rfm['Frequency'] = (1 + np.searchsorted([3,8,35], customer_rfm['NumberOfOrders(F)'])).astype('int8')
+    customer_rfm['Monetary'] = (1 + np.searchsorted([1000,10000,100000], customer_rfm['TotalSpent(M)'])).astype('int8')
     
     
     # Again, some plots to see the scorings (more uniform for recency, log for freq + monetary)
-    recency.hist(column = 'Recency')
-    frequency.hist(column = 'Frequency')
-    monetary.hist(column = 'Monetary')
-    
-    # Recombine, create score
-    customer_rfm = recency.merge(frequency, on = 'Customer ID', validate = 'one_to_one').merge(monetary, on = 'Customer ID', validate = 'one_to_one')
-    customer_rfm['RFMScore'] = customer_rfm['Recency'].astype(str) + customer_rfm['Frequency'].astype(str) + customer_rfm['Monetary'].astype(str)
+    customer_rfm.hist(column = 'Recency')
+    customer_rfm.hist(column = 'Frequency')
+    customer_rfm.hist(column = 'Monetary')
+    
+    # Create score, as an int code (R*100 + F*10 + M)
+    customer_rfm = customer_rfm[['Customer ID','DaysSinceLastPurchase(R)','Recency',
+                                 'NumberOfOrders(F)','Frequency','TotalSpent(M)','Monetary']]
+    recency = customer_rfm['Recency'].to_numpy()
+    frequency = customer_rfm['Frequency'].to_numpy()
+    monetary = customer_rfm['Monetary'].to_numpy()
+    total = recency + frequency + monetary
+    customer_rfm['RFMScore'] = recency.astype('int16') * 100 + frequency * 10 + monetary
+    rfm_score = customer_rfm['RFMScore'].to_numpy()
     
     # Create groupings of customers (a couple extreme cases, and some averages)
+    segment = np.full(len(customer_rfm), np.nan, dtype = object)
+    
+    segment[(total >= 4) & (total <= 6)] = 'Bad Customers'
+    segment[(total >= 7) & (total <= 9)] = 'Average Customers'
+    segment[(total >= 10) & (total <= 13)] = 'Good Customers'
     
-    customer_rfm.loc[(customer_rfm['Recency'] + customer_rfm['Frequency'] + customer_rfm['Monetary']).isin([4,5,6]), 'Segment'] = 'Bad Customers'
-    customer_rfm.loc[(customer_rfm['Recency'] + customer_rfm['Frequency'] + customer_rfm['Monetary']).isin([7,8,9]), 'Segment'] = 'Average Customers'
-    customer_rfm.loc[(customer_rfm['Recency'] + customer_rfm['Frequency'] + customer_rfm['Monetary']).isin([10,11,12,13]), 'Segment'] = 'Good Customers'
+    segment[recency == 1] = 'Lost Customers'
+    segment[frequency == 1] = 'Infrequent Shoppers'
+    segment[monetary == 1] = 'Small Spenders'
+    segment[rfm_score == 111] = 'Worst Customers'
     
-    customer_rfm.loc[customer_rfm['RFMScore'].str[0] == '1', 'Segment'] = 'Lost Customers'
-    customer_rfm.loc[customer_rfm['RFMScore'].str[1] == '1', 'Segment'] = 'Infrequent Shoppers'
-    customer_rfm.loc[customer_rfm['RFMScore'].str[2] == '1', 'Segment'] = 'Small Spenders'
-    customer_rfm.loc[customer_rfm['RFMScore'] == '111', 'Segment'] = 'Worst Customers'
+    segment[recency == 4] = 'Recent Customers'
+    segment[frequency == 4] = 'Frequent Shoppers'
+    segment[monetary == 4] = 'Big Spenders'
+    segment[rfm_score == 444] = 'Best Customers'
     
-    customer_rfm.loc[customer_rfm['RFMScore'].str[0] == '4', 'Segment'] = 'Recent Customers'
-    customer_rfm.loc[customer_rfm['RFMScore'].str[1] == '4', 'Segment'] = 'Frequent Shoppers'
-    customer_rfm.loc[customer_rfm['RFMScore'].str[2] == '4', 'Segment'] = 'Big Spenders'
-    customer_rfm.loc[customer_rfm['RFMScore'] == '444', 'Segment'] = 'Best Customers'
+    customer_rfm['Segment'] = segment
     
     return customer_rfm
 